@@ -8,19 +8,46 @@
 
 import datetime
 import argparse
-import collections
+import functools
+import hashlib
 import textwrap
 import operator
 import sys
 import os
 import re
-from xml.etree import ElementTree
-from xml.etree.ElementTree import Element
-from jinja2 import Environment, FileSystemLoader
+import io
+from dataclasses import dataclass
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+try:
+    # libxml2-backed parser, considerably faster on large object definitions
+    from lxml import etree as ElementTree
+    from lxml.etree import _Element as Element
+    _ITERPARSE_OPTIONS = dict(huge_tree=True, remove_blank_text=True)
+except ImportError:
+    from xml.etree import ElementTree
+    from xml.etree.ElementTree import Element
+    _ITERPARSE_OPTIONS = {}
 
 C_SINGLE_INST_TEMPLATE_FILENAME = "single_instance_template.c.jinja2"
 C_MULTIPLE_INSTS_TEMPLATE_FILENAME = "multiple_instances_template.c.jinja2"
 
+# Options affecting how templates are compiled
+_JINJA_SYNTAX_OPTIONS = dict(trim_blocks=True)
+# Without an explicit directory, Jinja keeps the bytecode cache in a private
+# per-user directory, so compiled templates are reused across invocations.
+# Cached entries are validated against the template source only, hence the
+# syntax options are part of the file names.
+_JINJA_CACHE_PATTERN = 'anjay_codegen_%s_{}.cache'.format(
+    hashlib.sha1(repr(sorted(_JINJA_SYNTAX_OPTIONS.items())).encode()).hexdigest()[:8])
+_JINJA_ENV = Environment(loader=FileSystemLoader(searchpath=os.path.join(os.path.dirname(__file__), './templates')),
+                         auto_reload=False,
+                         cache_size=-1,
+                         bytecode_cache=FileSystemBytecodeCache(pattern=_JINJA_CACHE_PATTERN),
+                         **_JINJA_SYNTAX_OPTIONS)
+_SINGLE_INST_TEMPLATE = _JINJA_ENV.get_template(C_SINGLE_INST_TEMPLATE_FILENAME)
+_MULTIPLE_INSTS_TEMPLATE = _JINJA_ENV.get_template(C_MULTIPLE_INSTS_TEMPLATE_FILENAME)
+
 NONALPHANUM_REGEX = re.compile(r'[^a-zA-Z0-9]+')
 
 DIGIT_SPELLINGS = {
@@ -36,36 +63,86 @@ DIGIT_SPELLINGS = {
     '9': 'nine'
 }
 
+TYPE_ENUMS = {
+    'string': 'ANJ_DATA_TYPE_STRING',
+    'integer': 'ANJ_DATA_TYPE_INT',
+    'float': 'ANJ_DATA_TYPE_DOUBLE',
+    'boolean': 'ANJ_DATA_TYPE_BOOL',
+    'opaque': 'ANJ_DATA_TYPE_BYTES',
+    'time': 'ANJ_DATA_TYPE_TIME',
+    'objlnk': 'ANJ_DATA_TYPE_OBJLNK',
+    'unsigned integer': 'ANJ_DATA_TYPE_UINT',
+    'corelnk': 'ANJ_DATA_TYPE_STRING',
+}
+
+UNION_RES_VALUE_FIELDS = {
+    'string': 'bytes_or_string.data',
+    'integer': 'int_value',
+    'float': 'double_value',
+    'boolean': 'bool_value',
+    'opaque': 'bytes_or_string.data',
+    'time': 'time_value',
+    'objlnk': 'objlnk',
+    'unsigned integer': 'uint_value',
+    'corelnk': 'bytes_or_string.data',
+}
+
+# Bits of ObjectDef._resource_flags
+RES_FLAG_READABLE = 1 << 0
+RES_FLAG_WRITABLE = 1 << 1
+RES_FLAG_EXECUTABLE = 1 << 2
+RES_FLAG_MULTIPLE = 1 << 3
+RES_FLAG_MULTIPLE_WRITABLE = 1 << 4
+
+# Wraps descriptions the same way as textwrap.fill(); comment prefixes are
+# inserted by joining the wrapped lines
+DESCRIPTION_WRAPPER = textwrap.TextWrapper()
+
 
 def _node_text(n: Element) -> str:
     return (n.text if (n is not None and n.text is not None) else '').strip()
 
 
+@functools.lru_cache(maxsize=None)
 def _sanitize_identifier(n: str) -> str:
     identifier = NONALPHANUM_REGEX.sub('_', n).strip('_')
     # Identifiers are not allowed to have a leading digit
-    return DIGIT_SPELLINGS.get(identifier[0], identifier[0]) + identifier[1:]
-
-
-class ResourceDef(collections.namedtuple('ResourceDef', ['rid', 'name', 'operations', 'multiple', 'mandatory', 'type',
-                                                         'range_enumeration', 'units', 'description'])):
-    @property
+    if identifier[0] in DIGIT_SPELLINGS:
+        return DIGIT_SPELLINGS[identifier[0]] + identifier[1:]
+    return identifier
+
+
+# Derived strings are looked up many times per render, hence cached_property;
+# it stores results in the instance __dict__, which also works for frozen classes
+@dataclass(frozen=True)
+class ResourceDef:
+    rid: int
+    name: str
+    operations: str
+    multiple: bool
+    mandatory: bool
+    type: str
+    range_enumeration: str
+    units: str
+    description: str
+
+    @functools.cached_property
     def mandatory_str(self) -> str:
         return 'Mandatory' if self.mandatory else 'Optional'
 
-    @property
+    @functools.cached_property
     def multiple_str(self):
         return 'Multiple' if self.multiple else 'Single'
 
-    @property
+    @functools.cached_property
     def name_upper(self) -> str:
         return _sanitize_identifier(self.name.upper())
     
-    @property
+    @functools.cached_property
     def name_snake(self) -> str:
         return _sanitize_identifier(self.name).lower()
 
-    @property
+    @functools.cached_property
     def kind_enum(self) -> str:
         if self.operations not in {'R', 'W', 'RW', 'E', 'BS_RW'}:
             raise AssertionError('unexpected operations: ' + self.operations)
@@ -76,40 +153,17 @@ class ResourceDef(collections.namedtuple('ResourceDef', ['rid', 'name', 'operati
             result += 'M'
         return result
     
-    @property
+    @functools.cached_property
     def type_enum(self) -> str:
-        types = {
-            'string': 'ANJ_DATA_TYPE_STRING',
-            'integer': 'ANJ_DATA_TYPE_INT',
-            'float': 'ANJ_DATA_TYPE_DOUBLE',
-            'boolean': 'ANJ_DATA_TYPE_BOOL',
-            'opaque': 'ANJ_DATA_TYPE_BYTES',
-            'time': 'ANJ_DATA_TYPE_TIME',
-            'objlnk': 'ANJ_DATA_TYPE_OBJLNK',
-            'unsigned integer': 'ANJ_DATA_TYPE_UINT',
-            'corelnk': 'ANJ_DATA_TYPE_STRING',
-        }
-
-        if self.type.lower() not in types and "E" not in self.operations:
+        type_lower = self.type.lower()
+        if type_lower not in TYPE_ENUMS and "E" not in self.operations:
             raise AssertionError(f'unknown type: {self.type}')
 
-        return types.get(self.type.lower(), 'ANJ_DATA_TYPE_NULL')
+        return TYPE_ENUMS.get(type_lower, 'ANJ_DATA_TYPE_NULL')
 
-    @property
+    @functools.cached_property
     def union_res_value_field(self) -> str:
-        types = {
-            'string': 'bytes_or_string.data',
-            'integer': 'int_value',
-            'float': 'double_value',
-            'boolean': 'bool_value',
-            'opaque': 'bytes_or_string.data',
-            'time': 'time_value',
-            'objlnk': 'objlnk',
-            'unsigned integer': 'uint_value',
-            'corelnk': 'bytes_or_string.data',
-        }
-
-        return types.get(self.type.lower(), 'Error: unknown type')
+        return UNION_RES_VALUE_FIELDS.get(self.type.lower(), 'Error: unknown type')
 
     @classmethod
     def from_etree(cls, res: Element) -> 'ResourceDef':
@@ -122,73 +176,119 @@ class ResourceDef(collections.namedtuple('ResourceDef', ['rid', 'name', 'operati
                    type=(_node_text(res.find('Type')).lower() or 'N/A'),
                    range_enumeration=(_node_text(res.find('RangeEnumeration')) or 'N/A'),
                    units=(_node_text(res.find('Units')) or 'N/A'),
-                   description=textwrap.fill(_node_text(res.find('Description'))).replace('\n', '\n\t * '))
+                   description='\n\t * '.join(DESCRIPTION_WRAPPER.wrap(_node_text(res.find('Description')))))
+
 
+@dataclass(frozen=True)
+class ObjectDef:
+    oid: int
+    name: str
+    version: str
+    description: str
+    urn: str
+    multiple: bool
+    mandatory: bool
+    resources: list[ResourceDef]
 
-class ObjectDef(collections.namedtuple('ObjectDef',
-                                       ['oid', 'name', 'version', 'description', 'urn', 'multiple', 'mandatory', 'resources'])):
-    @property
+    @functools.cached_property
     def name_snake(self) -> str:
         return _sanitize_identifier(self.name).lower()
 
-    @property
+    @functools.cached_property
     def name_pascal(self) -> str:
         return ''.join(word.capitalize() for word in _sanitize_identifier(self.name).split('_'))
     
-    @property
+    @functools.cached_property
     def name_upper(self) -> str:
         return _sanitize_identifier(self.name_snake.upper())
 
-    @property
+    @functools.cached_property
     def mandatory_str(self) -> str:
         return 'Mandatory' if self.mandatory else 'Optional'
 
-    @property
+    @functools.cached_property
     def multiple_str(self):
         return 'Multiple' if self.multiple else 'Single'
 
-    @property
+    @functools.cached_property
+    def _resource_flags(self) -> int:
+        # summary of all resources, gathered in a single pass for has_any_* properties
+        flags = 0
+        for res in self.resources:
+            if 'R' in res.operations:
+                flags |= RES_FLAG_READABLE
+            if 'W' in res.operations:
+                flags |= RES_FLAG_WRITABLE
+                if res.multiple:
+                    flags |= RES_FLAG_MULTIPLE_WRITABLE
+            if 'E' in res.operations:
+                flags |= RES_FLAG_EXECUTABLE
+            if res.multiple:
+                flags |= RES_FLAG_MULTIPLE
+        return flags
+
+    @functools.cached_property
     def has_any_readable_resources(self) -> bool:
-        return any('R' in res.operations for res in self.resources)
+        return bool(self._resource_flags & RES_FLAG_READABLE)
 
-    @property
+    @functools.cached_property
     def has_any_writable_resources(self) -> bool:
-        return any('W' in res.operations for res in self.resources)
+        return bool(self._resource_flags & RES_FLAG_WRITABLE)
 
-    @property
+    @functools.cached_property
     def has_any_executable_resources(self) -> bool:
-        return any('E' in res.operations for res in self.resources)
+        return bool(self._resource_flags & RES_FLAG_EXECUTABLE)
 
-    @property
+    @functools.cached_property
     def has_any_multiple_resources(self) -> bool:
-        return any(res.multiple for res in self.resources)
+        return bool(self._resource_flags & RES_FLAG_MULTIPLE)
 
-    @property
+    @functools.cached_property
     def has_any_multiple_writable_resources(self) -> bool:
-        return any((res.multiple and 'W' in res.operations) for res in self.resources)
+        return bool(self._resource_flags & RES_FLAG_MULTIPLE_WRITABLE)
 
-    @property
+    @functools.cached_property
     def needs_instance_reset_handler(self) -> bool:
         return self.multiple or self.has_any_writable_resources
 
-    @staticmethod
-    def parse_resources(obj: ElementTree):
-        return sorted([ResourceDef.from_etree(item) for item in obj.find('Resources').findall('Item')],
-                       key=operator.attrgetter('rid'))
-
     @classmethod
-    def from_etree(cls, obj: ElementTree, resources_subset: set) -> 'ObjectDef':
-        resources = ObjectDef.parse_resources(obj)
-        if resources_subset is not None:
-            resources = [ r for r in resources if r.rid in resources_subset ]
-
-        return cls(oid=int(_node_text(obj.find('ObjectID'))),
-                   name=_node_text(obj.find('Name')),
-                   version=_node_text(obj.find('ObjectVersion')),
-                   description=textwrap.fill(_node_text(obj.find('Description1'))).replace('\n', '\n * '),
-                   urn=_node_text(obj.find('ObjectURN')),
-                   multiple={'Single': False, 'Multiple': True}[_node_text(obj.find('MultipleInstances'))],
-                   mandatory={'Optional': False, 'Mandatory': True}[_node_text(obj.find('Mandatory'))],
+    def from_iter(cls, context, resources_subset: set) -> 'ObjectDef':
+        # consumes ('start', 'end') iterparse events; each <Item> subtree is
+        # dropped as soon as it has been turned into a ResourceDef
+        fields = {}
+        resources = []
+        path = []
+        resources_node = None
+        for event, elem in context:
+            if event == 'start':
+                path.append(elem.tag)
+                if path[1:] == ['Object', 'Resources']:
+                    resources_node = elem
+                continue
+
+            path.pop()
+            if len(path) == 1:
+                if elem.tag == 'Object':
+                    break
+            elif path[1:] == ['Object']:
+                fields[elem.tag] = _node_text(elem)
+            elif path[1:] == ['Object', 'Resources'] and elem.tag == 'Item':
+                res = ResourceDef.from_etree(elem)
+                if resources_subset is None or res.rid in resources_subset:
+                    resources.append(res)
+                resources_node.remove(elem)
+        else:
+            raise ValueError('no Object definition found')
+
+        resources.sort(key=operator.attrgetter('rid'))
+
+        return cls(oid=int(fields.get('ObjectID', '')),
+                   name=fields.get('Name', ''),
+                   version=fields.get('ObjectVersion', ''),
+                   description='\n * '.join(DESCRIPTION_WRAPPER.wrap(fields.get('Description1', ''))),
+                   urn=fields.get('ObjectURN', ''),
+                   multiple={'Single': False, 'Multiple': True}[fields.get('MultipleInstances', '')],
+                   mandatory={'Optional': False, 'Mandatory': True}[fields.get('Mandatory', '')],
                    resources=resources)
 
 
@@ -201,9 +301,6 @@ def generate_object_boilerplate(
         dynamic_instances: bool = False
         ) -> str:
 
-    template_loader = FileSystemLoader(searchpath=os.path.join(os.path.dirname(__file__), './templates'))
-    jinja_env = Environment(loader=template_loader, trim_blocks=True)
-
     resource_instances_dict = {}
     for rid, count in resource_instances or []:
         rid = int(rid)
@@ -228,9 +325,9 @@ def generate_object_boilerplate(
     )
 
     if obj.multiple == False or (instances_number and instances_number == 1):
-        return jinja_env.get_template(C_SINGLE_INST_TEMPLATE_FILENAME).render(**template_args)
+        return _SINGLE_INST_TEMPLATE.render(**template_args)
     elif instances_number and instances_number > 1:
-        return jinja_env.get_template(C_MULTIPLE_INSTS_TEMPLATE_FILENAME).render(**template_args)
+        return _MULTIPLE_INSTS_TEMPLATE.render(**template_args)
 
 if __name__ == '__main__':
     example_usage_text = '''
@@ -271,15 +368,16 @@ if __name__ == '__main__':
         parser.print_usage()
         sys.exit(1)
 
+    # the XML parser decodes the input itself, according to its encoding declaration
     input_source = None
     if args.input == '-':
-        input_source = sys.stdin.read()
+        input_source = sys.stdin.buffer.read()
     else:
-        with open(args.input) as f:
+        with open(args.input, 'rb') as f:
             input_source = f.read()
 
-    tree = ElementTree.fromstring(input_source)
-    obj = ObjectDef.from_etree(tree.find('Object'), args.resources)
+    context = ElementTree.iterparse(io.BytesIO(input_source), events=('start', 'end'), **_ITERPARSE_OPTIONS)
+    obj = ObjectDef.from_iter(context, args.resources)
 
     if args.list:
         for r in obj.resources:
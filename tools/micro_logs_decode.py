@@ -6,27 +6,44 @@
 # Licensed under AVSystem Anjay Lite LwM2M Client SDK - Non-Commercial License.
 # See the attached LICENSE file for details.
 
+import codecs
+import io
 import os
 import re
 import sys
 from pathlib import Path
 import argparse
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
 
 # Extensions to include
 SOURCE_EXTENSIONS = {".c", ".cpp", ".h", ".hpp"}
 
-# Regex to find ANJ_LOG_SOURCE_FILE_ID with arbitrary whitespace and optional parentheses
-DEFINE_REGEX = re.compile(r"\s*#\s*define\s+ANJ_LOG_SOURCE_FILE_ID\s+\(?\s*(\d+)\s*\)?")
-# Regex to find log patterns in input
-LOG_PATTERN_REGEX = re.compile(r"<ANJ_uLOG>(\d+);(\d+)</ANJ_uLOG>")
+# Below this number of files, scanning them is cheaper than starting a thread pool
+PARALLEL_SCAN_MIN_FILES = 200
+
+# Maximum number of input bytes decoded in one batch
+READ_CHUNK_SIZE = 65536
+
+# Directories that never contain project sources
+SKIPPED_DIRS = {".git", ".svn", ".hg"}
+
+# Literal that has to be present in a file for DEFINE_REGEX to match
+DEFINE_MARKER = b"ANJ_LOG_SOURCE_FILE_ID"
+# Regex to find ANJ_LOG_SOURCE_FILE_ID with arbitrary whitespace and optional parentheses,
+# matched against whole file contents; [^\S\n] is any whitespace except a line break
+DEFINE_REGEX = re.compile(rb"^[^\S\n]*#[^\S\n]*define[^\S\n]+ANJ_LOG_SOURCE_FILE_ID[^\S\n]+\(?[^\S\n]*(\d+)",
+                          re.MULTILINE)
+# Log patterns in input have the form of <ANJ_uLOG>file_id;line_number</ANJ_uLOG>
+LOG_PATTERN_START = "<ANJ_uLOG>"
+LOG_PATTERN_END = "</ANJ_uLOG>"
 
 def is_parent(p1: Path, p2: Path) -> bool:
-    try:
-        p2.relative_to(p1)
-        return True
-    except ValueError:
-        return False
+    # Both paths are expected to be resolved, so comparing strings is enough;
+    # rstrip() handles the filesystem root, which is the only one ending with a separator
+    s1, s2 = str(p1), str(p2)
+    return s2 == s1 or s2.startswith(s1.rstrip(os.sep) + os.sep)
 
 def collect_unique_root_dirs():
     cwd = Path.cwd().resolve()
@@ -40,44 +57,117 @@ def collect_unique_root_dirs():
     else:
         return [cwd, script_dir]
 
+def iter_source_files(root):
+    # os.scandir reuses the file type information from directory listing, so
+    # entries are filtered without creating Path objects or extra stat calls
+    stack = [str(root)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIPPED_DIRS:
+                        stack.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in SOURCE_EXTENSIONS and entry.is_file():
+                    yield entry.path
+
+def scan_file(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    # cheap literal check rejects most files before the regex runs
+    if DEFINE_MARKER not in data:
+        return None
+
+    match = DEFINE_REGEX.search(data)  # only first match per file
+    return int(match.group(1)) if match else None
+
+def scan_files(paths):
+    # Yields (path, callable returning the result of scan_file(path)) pairs, in
+    # order. Large trees are scanned by a thread pool, as reading the files
+    # releases the GIL.
+    if len(paths) < PARALLEL_SCAN_MIN_FILES:
+        for path in paths:
+            yield path, functools.partial(scan_file, path)
+        return
+
+    with ThreadPoolExecutor() as executor:
+        futures = [executor.submit(scan_file, path) for path in paths]
+        for path, future in zip(paths, futures):
+            yield path, future.result
+
 def find_file_ids(root_dirs, verbose):
     id_to_path = {}
     for root in root_dirs:
-        for path in root.rglob("*"):
-            if path.suffix.lower() in SOURCE_EXTENSIONS and path.is_file():
-                try:
-                    with path.open("r", encoding="utf-8", errors="ignore") as f:
-                        for line in f:
-                            match = DEFINE_REGEX.match(line)
-                            if match:
-                                file_id = int(match.group(1))
-                                if file_id in id_to_path:
-                                    raise ValueError(f"Collision: ID {file_id} defined in both:\n"
-                                                     f" - {id_to_path[file_id]}\n"
-                                                     f" - {path}")
-
-                                if verbose:
-                                    id_to_path[file_id] = str(path.resolve())
-                                else:
-                                    # strip root path from output
-                                    id_to_path[file_id] = str(path.relative_to(root))
-
-                                break  # only first match per file
-                except Exception as e:
-                    print(f"Error reading {path}: {e}", file=sys.stderr)
+        for path, get_file_id in scan_files(list(iter_source_files(root))):
+            try:
+                file_id = get_file_id()
+                if file_id is not None:
+                    if file_id in id_to_path:
+                        raise ValueError(f"Collision: ID {file_id} defined in both:\n"
+                                         f" - {id_to_path[file_id]}\n"
+                                         f" - {path}")
+
+                    if verbose:
+                        id_to_path[file_id] = str(Path(path).resolve())
+                    else:
+                        # strip root path from output
+                        id_to_path[file_id] = str(Path(path).relative_to(root))
+            except Exception as e:
+                print(f"Error reading {path}: {e}", file=sys.stderr)
     return id_to_path
 
-def process_input(file_id_map, input_file):
-    for line in input_file:
-        def replace(match):
-            file_id = int(match.group(1))
-            line_number = int(match.group(2))
-
-            file_path = file_id_map.get(file_id, f"<unknown file ID {file_id}>")
-            return f'[{file_path}:{line_number}]:'
-
-        line = LOG_PATTERN_REGEX.sub(replace, line)
-        print(line, end='')
+def decode_log_patterns(file_id_map, data, decoded_cache):
+    # Hand-written scanner used instead of a regex substitution. Splitting on
+    # the start marker is done at C speed, and decoded_cache maps contents of
+    # already seen patterns to their replacements, as the same log call sites
+    # show up over and over again.
+    pieces = data.split(LOG_PATTERN_START)
+    parts = [pieces[0]]
+    for piece in pieces[1:]:
+        end = piece.find(LOG_PATTERN_END)
+        body = piece[:end] if end >= 0 else None
+        replacement = decoded_cache.get(body)
+        if replacement is None and body is not None:
+            file_id, separator, line_number = body.partition(';')
+            # isdecimal() accepts exactly the characters that int() parses
+            if separator and file_id.isdecimal() and line_number.isdecimal():
+                file_id = int(file_id)
+                file_path = file_id_map.get(file_id, f"<unknown file ID {file_id}>")
+                replacement = decoded_cache[body] = f'[{file_path}:{int(line_number)}]:'
+
+        if replacement is None:
+            # malformed pattern, leave it as is
+            parts.append(LOG_PATTERN_START)
+            parts.append(piece)
+        else:
+            parts.append(replacement)
+            parts.append(piece[end + len(LOG_PATTERN_END):])
+    return ''.join(parts)
+
+def process_input(file_id_map, input_file, encoding, errors='strict', newline=None):
+    # input_file is a binary stream; encoding, errors and newline have the same
+    # meaning as for open() in text mode
+    # Input is decoded in batches of complete lines. read1() returns whatever
+    # is already available instead of waiting for a full chunk, so logs piped
+    # from a running application are still decoded in real time.
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    if newline is None:
+        decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+    decoded_cache = {}
+    pending = ''
+    while True:
+        chunk = input_file.read1(READ_CHUNK_SIZE)
+        data = pending + decoder.decode(chunk, final=not chunk)
+        end = data.rfind('\n') + 1 if chunk else len(data)
+        if end:
+            sys.stdout.write(decode_log_patterns(file_id_map, data[:end], decoded_cache))
+        pending = data[end:]
+        if not chunk:
+            break
 
 def main():
     parser = argparse.ArgumentParser(
@@ -95,17 +185,19 @@ def main():
         if args.root:
             cwd_path = Path.cwd().resolve()
             root_path = Path(args.root).resolve()
-            root_dirs = [cwd_path.joinpath(root_path)] if cwd_path.is_relative_to(root_path) else [ root_path ]
+            root_dirs = [cwd_path.joinpath(root_path)] if is_parent(root_path, cwd_path) else [ root_path ]
         else:
             root_dirs = collect_unique_root_dirs()
 
         file_id_map = find_file_ids(root_dirs, args.verbose)
 
         if args.input == '-':
-            process_input(file_id_map, sys.stdin)
+            # sys.stdin does not translate newlines on POSIX systems
+            process_input(file_id_map, sys.stdin.buffer, sys.stdin.encoding, sys.stdin.errors,
+                          newline='\n' if os.name == 'posix' else None)
         else:
-            with open(args.input, 'r', encoding='utf-8') as f:
-                process_input(file_id_map, f)
+            with open(args.input, 'rb') as f:
+                process_input(file_id_map, f, 'utf-8')
 
     except Exception as e:
         print(f"Fatal error: {e}", file=sys.stderr)